@@ -7,7 +7,7 @@ import datetime
 from pydantic import BaseModel, Field
 
 from medcat.cat import CAT
-from medcat.utils.regression.targeting import CUIWithChildFilter, FilterOptions, FilterType, TypedFilter, TranslationLayer, FilterStrategy
+from medcat.utils.regression.targeting import CUIWithChildFilter, FilterOptions, FilterType, TypedFilter, TranslationLayer, FilterStrategy, get_all_applicable_targets, get_any_applicable_targets
 
 from medcat.utils.regression.results import FailDescriptor, MultiDescriptor, ResultDescriptor
 
@@ -37,13 +37,9 @@ class RegressionCase(BaseModel):
             yield from self.filters[0].get_applicable_targets(translation, in_set)
             return
         if self.options.strategy == FilterStrategy.ANY:
-            for filter in self.filters:
-                yield from filter.get_applicable_targets(translation, in_set)
+            yield from get_any_applicable_targets(self.filters, translation, in_set)
         elif self.options.strategy == FilterStrategy.ALL:
-            cur_gen = in_set
-            for filter in self.filters:
-                cur_gen = filter.get_applicable_targets(translation, cur_gen)
-            yield from cur_gen
+            yield from get_all_applicable_targets(self.filters, translation, in_set)
 
     def check_specific_for_phrase(self, cat: CAT, cui: str, name: str, phrase: str,
                                   translation: TranslationLayer) -> bool:
@@ -59,16 +59,22 @@ class FailDescriptor(pydantic.BaseModel):
             ents = res['entities']
             found_cuis = [ents[nr]['cui'] for nr in ents]
             found_names = [ents[nr]['source_value'] for nr in ents]
-            found_children = translation.get_children_of(found_cuis, cui)
-            found_parents = translation.get_parents_of(found_cuis, cui)
+            # the first name found for each CUI
+            found_cui2name: Dict[str, str] = {}
+            for found_cui, found_name in zip(found_cuis, found_names):
+                found_cui2name.setdefault(found_cui, found_name)
+            # the children are only matched against the found CUIs so a set will do,
+            # the parents are listed in the order in which the CUIs were found
+            found_children = translation.get_children_of(set(found_cui2name), cui)
+            found_parents = translation.get_parents_of(found_cui2name.keys(), cui)
             if found_children:
                 fail_reason = FailReason.CUI_CHILD_FOUND
-                w_name = [(ccui, found_names[found_cuis.index(ccui)])
+                w_name = [(ccui, found_cui2name[ccui])
                           for ccui in found_children]
                 extra = format_matching(w_name)
             elif found_parents:
                 fail_reason = FailReason.CUI_PARENT_FOUND
-                w_name = [(ccui, found_names[found_cuis.index(ccui)])
+                w_name = [(ccui, found_cui2name[ccui])
                           for ccui in found_parents]
                 extra = format_matching(w_name)
             else:
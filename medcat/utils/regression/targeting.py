@@ -1,8 +1,10 @@
 from enum import Enum
+from functools import lru_cache
+from itertools import repeat
 import logging
-from typing import Dict, Iterable, Iterator, List, Set, Any, Tuple, Union
+from typing import Dict, FrozenSet, Iterable, Iterator, List, Optional, Set, Any, Tuple, Union
 
-from pydantic import BaseModel
+from pydantic import BaseModel, PrivateAttr
 
 from medcat.cdb import CDB
 
@@ -29,6 +31,8 @@ class TranslationLayer:
         cui2type_ids (Dict[str, Set[str]]): The map from CUI to type_ids
         cui2children (Dict[str, Set[str]]): The map from CUI to child CUIs
     """
+    max_cached_links: int = 100_000
+    """The maximum number of cached descendant/ancestor sets (per direction) before the cache is cleared"""
 
     def __init__(self, cui2names: Dict[str, Set[str]], name2cuis: Dict[str, List[str]],
                  cui2type_ids: Dict[str, Set[str]], cui2children: Dict[str, Set[str]]) -> None:
@@ -41,14 +45,24 @@ class TranslationLayer:
                 if type_id not in self.type_id2cuis:
                     self.type_id2cuis[type_id] = set()
                 self.type_id2cuis[type_id].add(cui)
+        # NOTE: CUIs without children need not be present in cui2children
         self.cui2children = cui2children
-        for cui in cui2names:
-            if cui not in cui2children:
-                self.cui2children[cui] = set()
+        self._cui2parents: Optional[Dict[str, Set[str]]] = None
+        self._mean_targets: Optional[Tuple[float, float]] = None
+        self._types_cache: Dict[FrozenSet[str], FrozenSet[str]] = {}
+        self._descendants_cache: Dict[Tuple[str, int], FrozenSet[str]] = {}
+        self._ancestors_cache: Dict[Tuple[str, int], FrozenSet[str]] = {}
 
     def targets_for(self, cui: str) -> Iterator[Tuple[str, str]]:
-        for name in self.cui2names[cui]:
-            yield cui, name
+        """Get the targets (i.e CUI and name pairs) for the specified CUI.
+
+        Args:
+            cui (str): The CUI
+
+        Returns:
+            Iterator[Tuple[str, str]]: The iterator of (CUI, name) tuples
+        """
+        return zip(repeat(cui), self.cui2names[cui])
 
     def all_targets(self, all_cuis: Set[str], all_names: Set[str], all_types: Set[str]) -> Iterator[Tuple[str, str]]:
         """Get a generator of all target information objects.
@@ -66,8 +80,7 @@ class TranslationLayer:
             if cui not in self.cui2names:
                 logger.warning('CUI not found in translation layer: %s', cui)
                 continue
-            for name in self.cui2names[cui]:
-                yield cui, name
+            yield from self.targets_for(cui)
         for name in all_names:
             if name not in self.name2cuis:
                 logger.warning('Name not found in translation layer: %s', name)
@@ -93,6 +106,39 @@ class TranslationLayer:
                         continue  # should have been yielded above
                     yield cui, name
 
+    def get_mean_targets(self) -> Tuple[float, float]:
+        """Get the mean number of targets (CUI and name pairs) per CUI and per name.
+
+        This is used to estimate how many targets a filter applies to.
+        The means are computed once and cached.
+
+        Returns:
+            Tuple[float, float]: The mean number of targets per CUI and per name
+        """
+        if self._mean_targets is None:
+            nr_of_targets = sum(len(names) for names in self.cui2names.values())
+            self._mean_targets = (nr_of_targets / max(len(self.cui2names), 1),
+                                  nr_of_targets / max(len(self.name2cuis), 1))
+        return self._mean_targets
+
+    def get_cuis_of_types(self, type_ids: Iterable[str]) -> FrozenSet[str]:
+        """Get all the CUIs that have any of the specified type IDs.
+
+        This uses the inverted type_id to CUI index and the result
+        is cached for the specific set of type IDs.
+
+        Args:
+            type_ids (Iterable[str]): The type IDs
+
+        Returns:
+            FrozenSet[str]: The CUIs with any of the type IDs
+        """
+        type_ids = frozenset(type_ids)
+        if type_ids not in self._types_cache:
+            self._types_cache[type_ids] = frozenset().union(
+                *(self.type_id2cuis.get(type_id, ()) for type_id in type_ids))
+        return self._types_cache[type_ids]
+
     def get_children_of(self, found_cuis: Iterable[str], cui: str, depth: int = 1) -> List[str]:
         """Get the children of the specifeid CUI in the listed CUIs (if they exist).
 
@@ -104,25 +150,16 @@ class TranslationLayer:
         Returns:
             List[str]: The list of children found
         """
-        if cui not in self.cui2children:
-            return []  # no children
-        children = self.cui2children[cui]
-        found_children = []
-        for child in children:
-            if child in found_cuis:
-                found_children.append(child)
-        if depth > 1:
-            for child in children:
-                found_children.extend(self.get_children_of(
-                    found_cuis, child, depth - 1))
-        return found_children
+        if not isinstance(found_cuis, (set, frozenset)):
+            found_cuis = set(found_cuis)
+        return list(self._get_descendants(cui, depth).intersection(found_cuis))
 
     def get_parents_of(self, found_cuis: Iterable[str], cui: str, depth: int = 1) -> List[str]:
         """Get the parents of the specifeid CUI in the listed CUIs (if they exist).
 
         If needed, higher order parents (i.e grandparents) can be queries for.
 
-        This uses the `get_children_of` method intenrnally.
+        This walks up the (lazily built) child to parent map from the specified CUI.
         That is, if any of the found CUIs have the specified CUI as a child of
         the specified depth, the found CUIs have a parent of the specified depth.
 
@@ -134,14 +171,48 @@ class TranslationLayer:
         Returns:
             List[str]: The list of parents found
         """
-        found_parents = []
-        for found_cui in found_cuis:
-            if self.get_children_of({cui}, found_cui, depth=depth):
-                # TODO - the intermediate results may get lost here
-                # i.e if found_cui is grandparent of the specified one,
-                # the direct parent is not listed
-                found_parents.append(found_cui)
-        return found_parents
+        ancestors = self._get_ancestors(cui, depth)
+        # TODO - the intermediate results may get lost here
+        # i.e if found_cui is grandparent of the specified one,
+        # the direct parent is not listed
+        return [found_cui for found_cui in found_cuis if found_cui in ancestors]
+
+    def _get_descendants(self, cui: str, depth: int) -> FrozenSet[str]:
+        return self._get_cached_linked(self._descendants_cache, self.cui2children, cui, depth)
+
+    def _get_ancestors(self, cui: str, depth: int) -> FrozenSet[str]:
+        if self._cui2parents is None:
+            self._cui2parents = {}
+            for parent, children in self.cui2children.items():
+                for child in children:
+                    if child not in self._cui2parents:
+                        self._cui2parents[child] = set()
+                    self._cui2parents[child].add(parent)
+        return self._get_cached_linked(self._ancestors_cache, self._cui2parents, cui, depth)
+
+    def _get_cached_linked(self, cache: Dict[Tuple[str, int], FrozenSet[str]],
+                           links: Dict[str, Set[str]], cui: str, depth: int) -> FrozenSet[str]:
+        # NOTE: the parent-child links are not expected to change after construction
+        key = (cui, depth)
+        if key not in cache:
+            if len(cache) >= self.max_cached_links:
+                cache.clear()
+            cache[key] = self._get_linked(links, cui, depth)
+        return cache[key]
+
+    @staticmethod
+    def _get_linked(links: Dict[str, Set[str]], cui: str, depth: int) -> FrozenSet[str]:
+        # iterative BFS so that shared subtrees (DAG) are only expanded once
+        # each level is handled with C-level set operations
+        visited: Set[str] = set()
+        frontier: Set[str] = set(links.get(cui, ()))
+        for _ in range(depth):
+            frontier -= visited
+            if not frontier:
+                break
+            visited |= frontier
+            frontier = set().union(*(links.get(linked, ()) for linked in frontier))
+        return frozenset(visited)
 
     @classmethod
     def from_CDB(cls, cdb: CDB) -> 'TranslationLayer':
@@ -185,7 +256,7 @@ class FilterStrategy(Enum):
         Returns:
             FilterStrategy: The matched FilterStrategy
         """
-        return loosely_match_enum(FilterStrategy, name)
+        return _match_filter_strategy(name)
 
 
 class FilterType(Enum):
@@ -210,7 +281,17 @@ class FilterType(Enum):
         Returns:
             FilterType: The matched FilterType
         """
-        return loosely_match_enum(FilterType, name)
+        return _match_filter_type(name)
+
+
+@lru_cache(maxsize=None)
+def _match_filter_strategy(name: str) -> FilterStrategy:
+    return loosely_match_enum(FilterStrategy, name)
+
+
+@lru_cache(maxsize=None)
+def _match_filter_type(name: str) -> FilterType:
+    return loosely_match_enum(FilterType, name)
 
 
 class TypedFilter(BaseModel):
@@ -218,6 +299,18 @@ class TypedFilter(BaseModel):
     """
     type: FilterType
     values: List[str]
+    _values_set: FrozenSet[str] = PrivateAttr(default_factory=frozenset)
+    _values_set_src: Optional[Tuple[str, ...]] = PrivateAttr(default=None)
+
+    def _get_values_set(self) -> FrozenSet[str]:
+        # The set is cached so that membership checks are O(1) rather than a list scan.
+        # It is rebuilt if the values have changed (i.e through construct, copy or
+        # editing the list), which is checked once per call rather than once per target.
+        values = tuple(self.values)
+        if values != self._values_set_src:
+            self._values_set = frozenset(values)
+            self._values_set_src = values
+        return self._values_set
 
     def get_applicable_targets(self, translation: TranslationLayer, in_gen: Iterator[Tuple[str, str]]) -> Iterator[Tuple[str, str]]:
         """Get all applicable targets for this filter
@@ -229,24 +322,28 @@ class TypedFilter(BaseModel):
         Yields:
             Iterator[Tuple[str, str]]: The output generator
         """
-        if self.type == FilterType.CUI or self.type == FilterType.CUI_AND_CHILDREN:
-            for cui, name in in_gen:
-                if cui in self.values:
-                    yield cui, name
+        # the type is loop-invariant, so dispatch once and run a single tight loop
         if self.type == FilterType.NAME:
-            for cui, name in in_gen:
-                if name in self.values:
-                    yield cui, name
+            values = self._get_values_set()
+            yield from ((cui, name) for cui, name in in_gen if name in values)
+        else:
+            allowed_cuis = self._resolve(translation)
+            yield from ((cui, name) for cui, name in in_gen if cui in allowed_cuis)
+
+    def _selectivity(self, translation: TranslationLayer) -> float:
+        # An estimate of how many targets (i.e CUI and name pairs) satisfy this filter
+        targets_per_cui, targets_per_name = translation.get_mean_targets()
+        if self.type == FilterType.NAME:
+            return len(self._get_values_set()) * targets_per_name
+        return len(self._resolve(translation)) * targets_per_cui
+
+    def _resolve(self, translation: TranslationLayer) -> FrozenSet[str]:
+        # The CUIs that satisfy a CUI or TYPE_ID filter.
+        # NAME filters are not resolved since they apply to the name
+        # of a target rather than to all the names of a CUI.
         if self.type == FilterType.TYPE_ID:
-            for cui, name in in_gen:
-                if cui in translation.cui2type_ids:
-                    tids = translation.cui2type_ids[cui]
-                else:
-                    tids = set()
-                for tid in tids:
-                    if tid in self.values:
-                        yield cui, name
-                        break
+            return translation.get_cuis_of_types(self._get_values_set())
+        return self._get_values_set()
 
     @classmethod
     def one_from_input(cls, target_type: str, vals: Union[str, list, dict]) -> 'TypedFilter':
@@ -314,10 +411,7 @@ class TypedFilter(BaseModel):
         Returns:
             dict: The dict
         """
-        d = {}
-        for filt_dict in TypedFilter.list_to_dicts(filters):
-            d.update(filt_dict)
-        return d
+        return {key: val for filt in filters for key, val in filt.to_dict().items()}
 
     @classmethod
     def from_dict(cls, input: Dict[str, Any]) -> List['TypedFilter']:
@@ -395,15 +489,57 @@ class CUIWithChildFilter(TypedFilter):
         Yields:
             Iterator[Tuple[str, str]]: The output generator
         """
+        # the delegate targets are yielded as they come and their CUIs are used
+        # to seed a single BFS for the children so that each target is only yielded once
+        seed_targets: Set[Tuple[str, str]] = set()
+        seeds: List[str] = []
         for cui, name in self.delegate.get_applicable_targets(translation, in_gen):
+            if (cui, name) in seed_targets:
+                continue
+            seed_targets.add((cui, name))
+            seeds.append(cui)
             yield cui, name
-            yield from self.get_children_of(translation, cui, cur_depth=1)
+        yield from self._get_children_of_seeds(translation, seeds, skip_targets=seed_targets)
+
+    def get_children_of(self, translation: TranslationLayer, cui: str, cur_depth: int = 1) -> Iterator[Tuple[str, str]]:
+        """Get the targets of the children of the specified CUI.
+
+        Args:
+            translation (TranslationLayer): The translation layer
+            cui (str): The parent CUI
+            cur_depth (int): The depth of the children of the CUI. Defaults to 1.
 
-    def get_children_of(self, translation: TranslationLayer, cui: str, cur_depth: int) -> Iterator[Tuple[str, str]]:
-        for child in translation.cui2children[cui]:
-            yield from translation.targets_for(child)
-            if cur_depth < self.depth:
-                yield from self.get_children_of(translation, child, cur_depth=cur_depth + 1)
+        Yields:
+            Iterator[Tuple[str, str]]: The output generator
+        """
+        yield from self._get_children_of_seeds(translation, [cui], depth=self.depth - cur_depth + 1)
+
+    def _get_children_of_seeds(self, translation: TranslationLayer, seeds: Iterable[str],
+                               skip_targets: Optional[Set[Tuple[str, str]]] = None,
+                               depth: Optional[int] = None) -> Iterator[Tuple[str, str]]:
+        # The children are found level by level (BFS) for all the seed (parent) CUIs at once
+        # so that children reachable through multiple paths are only yielded once.
+        # The targets in skip_targets have already been yielded.
+        if skip_targets is None:
+            skip_targets = set()
+        if depth is None:
+            depth = self.depth
+        frontier = list(dict.fromkeys(seeds))  # unique, in order
+        expanded = set(frontier)
+        visited: Set[str] = set()
+        for _ in range(depth):
+            next_frontier = []
+            for parent in frontier:
+                for child in translation.cui2children.get(parent, ()):
+                    if child in visited:
+                        continue
+                    visited.add(child)
+                    yield from (target for target in translation.targets_for(child)
+                                if target not in skip_targets)
+                    if child not in expanded:
+                        expanded.add(child)
+                        next_frontier.append(child)
+            frontier = next_frontier
 
     def to_dict(self) -> dict:
         """Convert this CUIWithChildFilter to a dict.
@@ -412,3 +548,76 @@ class CUIWithChildFilter(TypedFilter):
             dict: The dict representation
         """
         return {self.type.name: {'depth': self.depth, 'cui': self.delegate.values}}
+
+
+def get_all_applicable_targets(filters: List[TypedFilter], translation: TranslationLayer,
+                               in_gen: Iterator[Tuple[str, str]]) -> Iterator[Tuple[str, str]]:
+    """Get all the targets that satisfy all of the filters.
+
+    The filters are chained so that each one only sees the targets
+    that passed the previous ones.
+    Unless there are CUI_AND_CHILDREN filters (which add targets
+    rather than only filtering), the most selective filters are applied
+    first so that the later ones see as few targets as possible.
+
+    Args:
+        filters (List[TypedFilter]): The filters
+        translation (TranslationLayer): The translation layer
+        in_gen (Iterator[Tuple[str, str]]): The input generator / iterator
+
+    Yields:
+        Iterator[Tuple[str, str]]: The output generator
+    """
+    # the estimates need the TranslationLayer's statistics, otherwise the declared order is kept
+    if (isinstance(translation, TranslationLayer) and
+            all(filt.type != FilterType.CUI_AND_CHILDREN for filt in filters)):
+        filters = sorted(filters, key=lambda filt: filt._selectivity(translation))
+    cur_gen = in_gen
+    for filt in filters:
+        cur_gen = filt.get_applicable_targets(translation, cur_gen)
+    yield from cur_gen
+
+
+def get_any_applicable_targets(filters: List[TypedFilter], translation: TranslationLayer,
+                               in_gen: Iterator[Tuple[str, str]]) -> Iterator[Tuple[str, str]]:
+    """Get all the targets that satisfy any of the filters.
+
+    The filters are checked in a single pass over the input so that
+    a target satisfying multiple filters is only yielded once.
+    The children for any CUI_AND_CHILDREN filters are found after that pass.
+
+    Args:
+        filters (List[TypedFilter]): The filters
+        translation (TranslationLayer): The translation layer
+        in_gen (Iterator[Tuple[str, str]]): The input generator / iterator
+
+    Yields:
+        Iterator[Tuple[str, str]]: The output generator
+    """
+    allowed_cuis: Set[str] = set()
+    allowed_names: Set[str] = set()
+    child_filters: List[CUIWithChildFilter] = []
+    for filt in filters:
+        if isinstance(filt, CUIWithChildFilter):
+            child_filters.append(filt)
+            filt = filt.delegate
+        if filt.type == FilterType.NAME:
+            allowed_names.update(filt._get_values_set())
+        else:
+            allowed_cuis.update(filt._resolve(translation))
+    if not child_filters:
+        yield from ((cui, name) for cui, name in in_gen
+                    if cui in allowed_cuis or name in allowed_names)
+        return
+    # the targets found are only recorded when their children need to be found
+    seen: Set[Tuple[str, str]] = set()
+    for cui, name in in_gen:
+        if cui in allowed_cuis or name in allowed_names:
+            seen.add((cui, name))
+            yield cui, name
+    found_cuis = set(cui for cui, _ in seen)
+    for child_filter in child_filters:
+        seeds = found_cuis.intersection(child_filter.delegate._resolve(translation))
+        for target in child_filter._get_children_of_seeds(translation, seeds, skip_targets=seen):
+            seen.add(target)
+            yield target
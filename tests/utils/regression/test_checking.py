@@ -95,6 +95,39 @@ class TestTranslationLayer(unittest.TestCase):
                        ei[1] for ei in EXAMPLE_INFOS], [ei[2] for ei in EXAMPLE_INFOS]))
         self.assertEqual(len(targets), len(EXAMPLE_INFOS))
 
+    def test_gets_cuis_of_types(self):
+        tl = TranslationLayer.from_CDB(FakeCDB(*EXAMPLE_INFOS))
+        self.assertEqual(tl.get_cuis_of_types(['T1', 'T2', 'T-unknown']),
+                         set(EXAMPLE_TYPE_T1_CUI + EXAMPLE_TYPE_T2_CUI))
+
+    def test_get_children_of_finds_shared_descendant_once(self):
+        fakeCDB = FakeCDB(*EXAMPLE_INFOS)
+        # diamond: C123 -> (C124, C223) -> C224
+        fakeCDB.addl_info['pt2ch'].update({'C123': {'C124', 'C223'},
+                                           'C124': {'C224'},
+                                           'C223': {'C224'}})
+        tl = TranslationLayer.from_CDB(fakeCDB)
+        found = tl.get_children_of(['C124', 'C224'], 'C123', depth=2)
+        self.assertEqual(sorted(found), ['C124', 'C224'])
+
+    def test_get_parents_of_finds_grandparent(self):
+        fakeCDB = FakeCDB(*EXAMPLE_INFOS)
+        fakeCDB.addl_info['pt2ch'].update({'C123': {'C124'},
+                                           'C124': {'C224'}})
+        tl = TranslationLayer.from_CDB(fakeCDB)
+        self.assertEqual(tl.get_parents_of(['C123', 'C223'], 'C224', depth=1), [])
+        self.assertEqual(tl.get_parents_of(['C123', 'C223'], 'C224', depth=2), ['C123'])
+
+    def test_caches_descendants_per_cui_and_depth(self):
+        fakeCDB = FakeCDB(*EXAMPLE_INFOS)
+        fakeCDB.addl_info['pt2ch'].update({'C123': {'C124'},
+                                           'C124': {'C224'}})
+        tl = TranslationLayer.from_CDB(fakeCDB)
+        tl.get_children_of(['C224'], 'C123', depth=1)
+        tl.get_children_of(['C224'], 'C123', depth=2)
+        tl.get_children_of(['C124'], 'C123', depth=2)
+        self.assertEqual(set(tl._descendants_cache), {('C123', 1), ('C123', 2)})
+
 
 _CUI = 'C123'
 _NAME = 'NAMEof123'
@@ -202,6 +235,26 @@ class TestTypedFilter(unittest.TestCase):
         self.assertEqual(name, _NAME)
         self.assertEqual(cui, _CUI)
 
+    def test_get_applicable_targets_gets_targets_from_multiple_type_ids(self):
+        tl = TranslationLayer.from_CDB(FakeCDB(*EXAMPLE_INFOS))
+        tt = TypedFilter(type=FilterType.TYPE_ID, values=['T1', 'T3'])
+        targets = list(tt.get_applicable_targets(tl, tl.all_targets([ei[0] for ei in EXAMPLE_INFOS], [
+                       ei[1] for ei in EXAMPLE_INFOS], [ei[2] for ei in EXAMPLE_INFOS])))
+        self.assertEqual(set(cui for cui, _ in targets),
+                         set(EXAMPLE_TYPE_T1_CUI + EXAMPLE_TYPE_T3_CUI))
+
+    def test_get_applicable_targets_follows_changed_values(self):
+        tl = TranslationLayer.from_CDB(FakeCDB(*EXAMPLE_INFOS))
+        constructed = TypedFilter.construct(type=FilterType.CUI, values=['C123'])
+        copied = constructed.copy(update={'values': ['C124']})
+        edited = TypedFilter(type=FilterType.CUI, values=['C123'])
+        list(edited.get_applicable_targets(tl, tl.all_targets({'C123'}, set(), set())))
+        edited.values.append('C223')
+        for tt, expected in [(constructed, {'C123'}), (copied, {'C124'}), (edited, {'C123', 'C223'})]:
+            with self.subTest(f'With values {tt.values}'):
+                targets = tt.get_applicable_targets(tl, tl.all_targets({'C123', 'C124', 'C223'}, set(), set()))
+                self.assertEqual(set(cui for cui, _ in targets), expected)
+
 
 class TestFilterOptions(unittest.TestCase):
 
@@ -413,6 +466,91 @@ class TestRegressionCase(unittest.TestCase):
                     expected += len(cdb.cui2names[child3])
         self.assertEqual(success, expected)
 
+    PT2CHILD_DIAMOND = {P_CUI: set([C_CUI1, C_CUI2]),
+                        C_CUI1: set([C_CUI1_C1]),
+                        C_CUI2: set([C_CUI1_C1])}
+
+    def test_cui_and_children_finds_shared_child_once(self):
+        NAME = 'NAMEpt2ch'
+        cdb = FakeCDB(*EXAMPLE_INFOS)
+        cdb.addl_info['pt2ch'].update(self.PT2CHILD_DIAMOND)
+        tl = TranslationLayer.from_CDB(cdb)
+        D = self.D_MULIT_CHILD_1
+        rc: RegressionCase = RegressionCase.from_dict(NAME, D)
+        targets = list(rc.get_all_targets(tl.all_targets(*rc._get_all_cuis_names_types()), tl))
+        self.assertEqual(len(targets), len(set(targets)))
+        expected = set((cui, name) for cui in [self.P_CUI, self.C_CUI1, self.C_CUI2, self.C_CUI1_C1]
+                       for name in cdb.cui2names[cui])
+        self.assertEqual(set(targets), expected)
+
+    def test_get_children_of_gets_children_of_single_cui(self):
+        cdb = FakeCDB(*EXAMPLE_INFOS)
+        cdb.addl_info['pt2ch'].update(self.PT2CHILD_M1)
+        tl = TranslationLayer.from_CDB(cdb)
+        filt, = TypedFilter.from_dict({'cui_and_children': {'cui': self.P_CUI, 'depth': 2}})
+        for cur_depth, children in [(1, [self.C_CUI1, self.C_CUI2, self.C_CUI1_C1]),
+                                    (2, [self.C_CUI1, self.C_CUI2])]:
+            with self.subTest(f'At depth {cur_depth}'):
+                targets = list(filt.get_children_of(tl, self.P_CUI, cur_depth=cur_depth))
+                expected = set((cui, name) for cui in children for name in cdb.cui2names[cui])
+                self.assertEqual(set(targets), expected)
+
+    def test_cui_and_children_finds_children_once_for_multiple_parent_names(self):
+        NAME = 'NAMEpt2ch'
+        cdb = FakeCDB(*EXAMPLE_INFOS, [self.PARENT_CUI, 'N123-alt', 'T1'])
+        cdb.addl_info['pt2ch'].update(self.PT2CHILD)
+        tl = TranslationLayer.from_CDB(cdb)
+        rc: RegressionCase = RegressionCase.from_dict(NAME, self.D_PARENT_W_CHILDREN)
+        targets = list(rc.get_all_targets(tl.all_targets(*rc._get_all_cuis_names_types()), tl))
+        self.assertEqual(len(targets), len(set(targets)))
+        self.assertEqual(len(targets), len(cdb.cui2names[self.PARENT_CUI]) +
+                         len(cdb.cui2names[self.CHILD_CUI]))
+
+    def test_ALL_strategy_estimates_selectivity_in_targets(self):
+        tl = TranslationLayer.from_CDB(FakeCDB(*EXAMPLE_INFOS))
+        D = {'targeting': {'strategy': 'all', 'filters': {
+            'cui': ['C123', 'C124', 'C223'], 'name': 'N123'}}, 'phrases': ['%s']}
+        rc: RegressionCase = RegressionCase.from_dict('ALLNAME', D)
+        cui_filter, name_filter = rc.filters
+        # 6 targets for 6 CUIs and 4 names: 3 CUIs at 1 target each vs 1 name at 1.5 targets
+        self.assertEqual(cui_filter._selectivity(tl), 3)
+        self.assertEqual(name_filter._selectivity(tl), 1.5)
+        targets = list(rc.get_all_targets(tl.all_targets(*rc._get_all_cuis_names_types()), tl))
+        self.assertEqual(targets, [('C123', 'N123')])
+
+    def test_ALL_strategy_keeps_order_without_translation_layer(self):
+        D = {'targeting': {'strategy': 'all', 'filters': {
+            'cui': ['C123', 'C124'], 'name': 'N123'}}, 'phrases': ['%s']}
+        rc: RegressionCase = RegressionCase.from_dict('ALLNAME', D)
+        in_targets = [('C123', 'N123'), ('C124', 'N124')]
+        targets = list(rc.get_all_targets(iter(in_targets), object()))
+        self.assertEqual(targets, [('C123', 'N123')])
+
+    def test_ANY_strategy_yields_overlapping_targets_once(self):
+        cdb = FakeCDB(*EXAMPLE_INFOS)
+        cdb.addl_info['pt2ch'].update(self.PT2CHILD)
+        tl = TranslationLayer.from_CDB(cdb)
+        for filters in [{'cui': self.PARENT_CUI, 'name': 'N123'},
+                        {'cui': self.PARENT_CUI,
+                         'cui_and_children': {'cui': self.PARENT_CUI, 'depth': 1}}]:
+            with self.subTest(f'With filters {filters}'):
+                D = {'targeting': {'strategy': 'any', 'filters': filters}, 'phrases': ['%s']}
+                rc: RegressionCase = RegressionCase.from_dict('ANYNAME', D)
+                targets = list(rc.get_all_targets(tl.all_targets(*rc._get_all_cuis_names_types()), tl))
+                self.assertEqual(len(targets), len(set(targets)))
+                self.assertIn((self.PARENT_CUI, 'N123'), targets)
+
+    def test_strategies_pass_repeated_input_targets_through(self):
+        tl = TranslationLayer.from_CDB(FakeCDB(*EXAMPLE_INFOS))
+        in_targets = [(self.PARENT_CUI, 'N123')] * 2
+        for strategy in ['any', 'all']:
+            with self.subTest(f'With strategy {strategy}'):
+                D = {'targeting': {'strategy': strategy, 'filters': {
+                    'cui': self.PARENT_CUI, 'name': 'N123'}}, 'phrases': ['%s']}
+                rc: RegressionCase = RegressionCase.from_dict('REPEATED', D)
+                targets = list(rc.get_all_targets(iter(in_targets), tl))
+                self.assertEqual(targets, in_targets)
+
     def test_gets_with_ANY_strategy(self):
         NAME = 'ANYNAME'
         tl = TranslationLayer.from_CDB(FakeCDB(*EXAMPLE_INFOS))
@@ -421,7 +559,7 @@ class TestRegressionCase(unittest.TestCase):
         rc: RegressionCase = RegressionCase.from_dict(NAME, D)
         success, fail = rc.check_case(FakeCat(tl), tl)
         self.assertEqual(fail, 0)
-        expected = sum([len(tl.cui2children[cui]) for cui in D['targeting']
+        expected = sum([len(tl.cui2names[cui]) for cui in D['targeting']
                        ['filters']['cui']]) + len(D['targeting']['filters']['name'])
         self.assertEqual(success, expected)
 